@@ -41,112 +41,61 @@ from litepcie.software import generate_litepcie_software
 
 from litedram.modules import MT40A512M16
 from litedram.phy import usddrphy
+from litedram.frontend.dma import LiteDRAMDMAWriter
 
 from litescope import LiteScopeAnalyzer
 
-from gateware.adc08dj import ADC08DJ5200RFCore
+from gateware.adc08dj import ADC08DJ5200RFCore, adc08dj_phy_rx_orders, adc08dj_phy_rx_polarities
 
 # ADC08DJ5200RF FMC IOs ----------------------------------------------------------------------------
 
-adc08dj5200rf_fms_ios = [
-    # GTH Reference Clk (156.25 MHz).
-    # -------------------------------
-    ("adc08dj5200rf_refclk", 0,
-        Subsignal("p", Pins("HPC:GBTCLK0_M2C_P")),
-        Subsignal("n", Pins("HPC:GBTCLK0_M2C_N")),
-    ),
-    # GTH RX Lanes.
-    # -------------
-    ("adc08dj5200rf_jesd_rx", 0,
-        Subsignal("p",  Pins("HPC:DP0_M2C_P")),
-        Subsignal("n",  Pins("HPC:DP0_M2C_N")),
-    ),
-    ("adc08dj5200rf_jesd_rx", 1,
-        Subsignal("p",  Pins("HPC:DP1_M2C_P")),
-        Subsignal("n",  Pins("HPC:DP1_M2C_N")),
-    ),
-    ("adc08dj5200rf_jesd_rx", 2,
-        Subsignal("p",  Pins("HPC:DP2_M2C_P")),
-        Subsignal("n",  Pins("HPC:DP2_M2C_N")),
-    ),
-    ("adc08dj5200rf_jesd_rx", 3,
-        Subsignal("p",  Pins("HPC:DP3_M2C_P")),
-        Subsignal("n",  Pins("HPC:DP3_M2C_N")),
-    ),
-    ("adc08dj5200rf_jesd_rx", 4,
-        Subsignal("p",  Pins("HPC:DP4_M2C_P")),
-        Subsignal("n",  Pins("HPC:DP4_M2C_N")),
-    ),
-    ("adc08dj5200rf_jesd_rx", 5,
-        Subsignal("p",  Pins("HPC:DP5_M2C_P")),
-        Subsignal("n",  Pins("HPC:DP5_M2C_N")),
-    ),
-    ("adc08dj5200rf_jesd_rx", 6,
-        Subsignal("p",  Pins("HPC:DP6_M2C_P")),
-        Subsignal("n",  Pins("HPC:DP6_M2C_N")),
-    ),
-    ("adc08dj5200rf_jesd_rx", 7,
-        Subsignal("p",  Pins("HPC:DP7_M2C_P")),
-        Subsignal("n",  Pins("HPC:DP7_M2C_N")),
-    ),
-    # GTH TX Lanes.(Not used, but still need to be provided to LiteICLink PHY).
-    # -------------------------------------------------------------------------
-    ("adc08dj5200rf_jesd_tx", 0,
-        Subsignal("p",  Pins("HPC:DP0_C2M_P")),
-        Subsignal("n",  Pins("HPC:DP0_C2M_N")),
-    ),
-    ("adc08dj5200rf_jesd_tx", 1,
-        Subsignal("p",  Pins("HPC:DP1_C2M_P")),
-        Subsignal("n",  Pins("HPC:DP1_C2M_N")),
-    ),
-    ("adc08dj5200rf_jesd_tx", 2,
-        Subsignal("p",  Pins("HPC:DP2_C2M_P")),
-        Subsignal("n",  Pins("HPC:DP2_C2M_N")),
-    ),
-    ("adc08dj5200rf_jesd_tx", 3,
-        Subsignal("p",  Pins("HPC:DP3_C2M_P")),
-        Subsignal("n",  Pins("HPC:DP3_C2M_N")),
-    ),
-    ("adc08dj5200rf_jesd_tx", 4,
-        Subsignal("p",  Pins("HPC:DP4_C2M_P")),
-        Subsignal("n",  Pins("HPC:DP4_C2M_N")),
-    ),
-    ("adc08dj5200rf_jesd_tx", 5,
-        Subsignal("p",  Pins("HPC:DP5_C2M_P")),
-        Subsignal("n",  Pins("HPC:DP5_C2M_N")),
-    ),
-    ("adc08dj5200rf_jesd_tx", 6,
-        Subsignal("p",  Pins("HPC:DP6_C2M_P")),
-        Subsignal("n",  Pins("HPC:DP6_C2M_N")),
-    ),
-    ("adc08dj5200rf_jesd_tx", 7,
-        Subsignal("p",  Pins("HPC:DP7_C2M_P")),
-        Subsignal("n",  Pins("HPC:DP7_C2M_N")),
-    ),
-
-    # Jsync.
-    # ------
-    ("adc08dj5200rf_sync", 0, Pins("HPC:LA28_P"), IOStandard("LVCMOS18")),
-
-    # SysRef.
-    # -------
-    ("adc08dj5200rf_sysref", 0,
-        Subsignal("p", Pins("HPC:LA03_P"), IOStandard("LVDS")),
-        Subsignal("n", Pins("HPC:LA03_N"), IOStandard("LVDS"))
-    ),
-
-    # SPI.
-    # ----
-    ("adc08dj5200rf_spi", 0,
-        # FIXME: Not yet use in design since configuring ADC through EVM GUI.
-        Subsignal("cs_n",   Pins("HPC:LA04_N FMC1_HPC:LA05_P")),
-        Subsignal("miso",   Pins("HPC:LA04_P"), Misc("PULLUP TRUE")),
-        Subsignal("mosi",   Pins("HPC:LA03_N")),
-        Subsignal("clk",    Pins("HPC:LA03_P")),
-        Subsignal("spi_en", Pins("HPC:LA05_N")),
-        IOStandard("LVCMOS18")
-    ),
-]
+def adc08dj5200rf_fmc_ios(jesd_lanes=8):
+    return [
+        # GTH Reference Clk (156.25 MHz).
+        # -------------------------------
+        ("adc08dj5200rf_refclk", 0,
+            Subsignal("p", Pins("HPC:GBTCLK0_M2C_P")),
+            Subsignal("n", Pins("HPC:GBTCLK0_M2C_N")),
+        ),
+    ] + [
+        # GTH RX Lanes.
+        # -------------
+        # Note: HPC DP pins are dedicated GTH pins, so they also fix the GTH channels/quads used.
+        ("adc08dj5200rf_jesd_rx", i,
+            Subsignal("p",  Pins(f"HPC:DP{i}_M2C_P")),
+            Subsignal("n",  Pins(f"HPC:DP{i}_M2C_N")),
+        ) for i in range(jesd_lanes)
+    ] + [
+        # GTH TX Lanes.(Not used, but still need to be provided to LiteICLink PHY).
+        # -------------------------------------------------------------------------
+        ("adc08dj5200rf_jesd_tx", i,
+            Subsignal("p",  Pins(f"HPC:DP{i}_C2M_P")),
+            Subsignal("n",  Pins(f"HPC:DP{i}_C2M_N")),
+        ) for i in range(jesd_lanes)
+    ] + [
+        # Jsync.
+        # ------
+        ("adc08dj5200rf_sync", 0, Pins("HPC:LA28_P"), IOStandard("LVCMOS18")),
+
+        # SysRef.
+        # -------
+        ("adc08dj5200rf_sysref", 0,
+            Subsignal("p", Pins("HPC:LA03_P"), IOStandard("LVDS")),
+            Subsignal("n", Pins("HPC:LA03_N"), IOStandard("LVDS"))
+        ),
+
+        # SPI.
+        # ----
+        ("adc08dj5200rf_spi", 0,
+            # FIXME: Not yet use in design since configuring ADC through EVM GUI.
+            Subsignal("cs_n",   Pins("HPC:LA04_N FMC1_HPC:LA05_P")),
+            Subsignal("miso",   Pins("HPC:LA04_P"), Misc("PULLUP TRUE")),
+            Subsignal("mosi",   Pins("HPC:LA03_N")),
+            Subsignal("clk",    Pins("HPC:LA03_P")),
+            Subsignal("spi_en", Pins("HPC:LA05_N")),
+            IOStandard("LVCMOS18")
+        ),
+    ]
 
 # CRG ----------------------------------------------------------------------------------------------
 
@@ -170,7 +119,7 @@ class _CRG(LiteXModule):
         pll.create_clkout(self.cd_idelay, 300e6)
         platform.add_false_path_constraints(self.cd_sys.clk, pll.clkin) # Ignore sys_clk to pll.clkin path created by SoC's rst.
 
-        # IDelayCtrl.
+        # IDelayCtrl (Also holds cd_sys in reset until IDELAYCTRL calibration is done).
         self.idelayctrl = USIDELAYCTRL(cd_ref=self.cd_idelay, cd_sys=self.cd_sys)
 
 # BaseSoC ------------------------------------------------------------------------------------------
@@ -182,11 +131,13 @@ class BaseSoC(SoCMini):
         with_remap         = True,
         without_ram        = True,
         pcie_speed         = "gen4",
+        with_dram_capture  = False,
+        adc08dj_jesd_lanes = 8,
         **kwargs
     ):
         # Platform ---------------------------------------------------------------------------------
         platform = alinx_axau15.Platform()
-        platform.add_extension(adc08dj5200rf_fms_ios)
+        platform.add_extension(adc08dj5200rf_fmc_ios(jesd_lanes=adc08dj_jesd_lanes))
 
         # CRG --------------------------------------------------------------------------------------
         self.crg = _CRG(platform, sys_clk_freq)
@@ -208,16 +159,17 @@ class BaseSoC(SoCMini):
         self.add_etherbone(phy=self.ethphy, ip_address="192.168.1.50")
 
         # DDR4 SDRAM -------------------------------------------------------------------------------
-        if not without_ram and not self.integrated_main_ram_size:
+        if (not without_ram or with_dram_capture) and not self.integrated_main_ram_size:
             self.ddrphy = usddrphy.USPDDRPHY(platform.request("ddram"),
                 memtype          = "DDR4",
                 sys_clk_freq     = sys_clk_freq,
                 iodelay_clk_freq = 500e6)
             self.add_sdram("sdram",
-                phy           = self.ddrphy,
-                module        = MT40A512M16(sys_clk_freq, "1:4"),
-                size          = 0x40000000,
-                l2_cache_size = kwargs.get("l2_size", 8192)
+                phy                     = self.ddrphy,
+                module                  = MT40A512M16(sys_clk_freq, "1:4"),
+                size                    = 0x40000000,
+                l2_cache_size           = kwargs.get("l2_size", 32768),
+                l2_cache_min_data_width = 256,
             )
 
         # PCIe -------------------------------------------------------------------------------------
@@ -246,10 +198,10 @@ class BaseSoC(SoCMini):
         # ADC08DJ5200RF ----------------------------------------------------------------------------
         self.adc08dj = ADC08DJ5200RFCore(platform, sys_clk_freq,
             adc08dj_refclk_freq     = 156.25e6,
-            adc08dj_jesd_lanes      = 8,
+            adc08dj_jesd_lanes      = adc08dj_jesd_lanes,
             adc08dj_jesd_linerate   = 6.25e9,
-            adc08dj_phy_rx_order    = [3, 0, 2, 1, 7, 4, 6, 5],
-            adc08dj_phy_rx_polarity = [0, 0, 0, 0, 1, 1, 1, 1],
+            adc08dj_phy_rx_order    = adc08dj_phy_rx_orders[adc08dj_jesd_lanes],
+            adc08dj_phy_rx_polarity = adc08dj_phy_rx_polarities[adc08dj_jesd_lanes],
         )
         
         if with_remap or with_pcie:
@@ -290,8 +242,11 @@ class BaseSoC(SoCMini):
                 #self.comb += sample[(i*32):((i+1)*32)].eq(converter_data[0:31])                    
             # exit()
             if with_pcie:
-                self.comb += self.pcie_dma0.sink.valid.eq(self.adc08dj.jesd_rx_core.ready)
-                self.sync += If(self.pcie_dma0.sink.valid, self.pcie_dma0.sink.data.eq(self.adc08dj.sample))
+                self.pcie_conv = stream.Converter(len(self.adc08dj.sample), {"gen3": 128, "gen4": 256}[pcie_speed])
+                self.comb += [
+                    self.adc08dj.source.connect(self.pcie_conv.sink),
+                    self.pcie_conv.source.connect(self.pcie_dma0.sink),
+                ]
 
             #self.sync += If(self.pcie_dma0.sink.valid, self.pcie_dma0.sink.data.eq(self.adc08dj.jesd_rx_core.source.data))
 
@@ -316,6 +271,21 @@ class BaseSoC(SoCMini):
             #self.comb += self.pcie_dma0.sink
             #self.comb += self.pcie_dma0.sink.
 
+        # ADC08DJ5200RF DRAM Capture ---------------------------------------------------------------
+        if with_dram_capture:
+            assert hasattr(self, "sdram"), "DRAM capture requires DDR4 SDRAM."
+            assert not with_pcie, "DRAM capture and PCIe both consume the ADC stream and are exclusive."
+            port = self.sdram.crossbar.get_port(mode="write")
+            self.dram_conv   = stream.Converter(len(self.adc08dj.sample), port.data_width)
+            self.dram_writer = LiteDRAMDMAWriter(port, fifo_depth=16, with_csr=True)
+            self.comb += [
+                self.adc08dj.source.connect(self.dram_conv.sink),
+                self.dram_conv.source.connect(self.dram_writer.sink),
+            ]
+
+        # No ADC stream consumer: always accept samples so the CDC does not report overflows.
+        if not (with_pcie or with_dram_capture):
+            self.comb += self.adc08dj.source.ready.eq(1)
 
     # Analyzer -------------------------------------------------------------------------------------
 
@@ -344,18 +314,21 @@ class BaseSoC(SoCMini):
 
 def main():
     parser = argparse.ArgumentParser(description="FastScope Test SoC on AXAU15.")
-    parser.add_argument("--build",           action ="store_true",      help="Build bitstream.")
-    parser.add_argument("--load",            action ="store_true",      help="Load bitstream.")
-    parser.add_argument("--sys-clk-freq",    default=300e6, type=float, help="System clock frequency.")
-    parser.add_argument("--driver",          action="store_true",       help="Generate LitePCIe driver.")
-    parser.add_argument("--with-pcie",       action="store_true",       help="Enable PCIe support.")        
-    parser.add_argument("--pcie-speed",      default="gen4",            help="PCIe speed.", choices=["gen3", "gen4"])
+    parser.add_argument("--build",             action ="store_true",      help="Build bitstream.")
+    parser.add_argument("--load",              action ="store_true",      help="Load bitstream.")
+    parser.add_argument("--sys-clk-freq",      default=300e6, type=float, help="System clock frequency.")
+    parser.add_argument("--driver",            action="store_true",       help="Generate LitePCIe driver.")
+    parser.add_argument("--pcie-speed",        default="gen4",            help="PCIe speed.", choices=["gen3", "gen4"])
+    capture_group = parser.add_mutually_exclusive_group()
+    capture_group.add_argument("--with-pcie",         action="store_true", help="Enable PCIe support.")
+    capture_group.add_argument("--with-dram-capture", action="store_true", help="Enable ADC samples capture to DDR4 SDRAM.")
     args = parser.parse_args()
 
     soc = BaseSoC(
-        sys_clk_freq = args.sys_clk_freq,
-        with_pcie    = args.with_pcie,
-        pcie_speed   = args.pcie_speed,
+        sys_clk_freq      = args.sys_clk_freq,
+        with_pcie         = args.with_pcie,
+        pcie_speed        = args.pcie_speed,
+        with_dram_capture = args.with_dram_capture,
 	)
     soc.add_jesd_rx_probe()
 
@@ -15,6 +15,7 @@ from litex.build.xilinx.common import DifferentialInput
 
 from litex.soc.cores.clock import *
 from litex.soc.interconnect.csr import *
+from litex.soc.interconnect import stream
 
 from liteiclink.serdes.gth4_ultrascale import GTH4QuadPLL, GTH4
 
@@ -23,6 +24,60 @@ from litejesd204b.core import LiteJESD204BCoreTX
 from litejesd204b.core import LiteJESD204BCoreRX
 from litejesd204b.core import LiteJESD204BCoreControl
 
+# JESD Modes ---------------------------------------------------------------------------------------
+
+adc08dj_jesd_modes = {
+    # Lanes: JESD204B Physical/Transport Settings.
+    4: dict(l=4, m=4, n=8, np=8, f=2, s=1, k=32, cs=0),
+    8: dict(l=8, m=8, n=8, np=8, f=2, s=1, k=32, cs=0),
+}
+
+adc08dj_phy_rx_orders = {
+    # Lanes: JESD Lane -> PHY.
+    4: [3, 0, 2, 1],
+    8: [3, 0, 2, 1, 7, 4, 6, 5],
+}
+
+adc08dj_phy_rx_polarities = {
+    # Lanes: PHY RX Polarity.
+    4: [0, 0, 0, 0],
+    8: [0, 0, 0, 0, 1, 1, 1, 1],
+}
+
+# Helpers ------------------------------------------------------------------------------------------
+
+def tree_and(signals):
+    # Balanced AND reduction (log2(N) logic levels instead of N-1 for a folded reduce).
+    if len(signals) == 1:
+        return signals[0]
+    return tree_and(signals[:len(signals)//2]) & tree_and(signals[len(signals)//2:])
+
+# Clk Measurement ----------------------------------------------------------------------------------
+
+class ClkMeasurement(LiteXModule):
+    def __init__(self, clk, increment=1):
+        self.latch = CSR()
+        self.value = CSRStatus(64)
+
+        # # #
+
+        # Create Clock Domain.
+        self.cd_counter = ClockDomain()
+        self.comb += self.cd_counter.clk.eq(clk)
+        self.specials += AsyncResetSynchronizer(self.cd_counter, ResetSignal())
+
+        # Free-running Clock Counter.
+        counter = Signal(64)
+        self.sync.counter += counter.eq(counter + increment)
+
+        # Latch Clock Counter.
+        latch_value = Signal(64)
+        latch_sync  = PulseSynchronizer("sys", "counter")
+        self.submodules += latch_sync
+        self.comb += latch_sync.i.eq(self.latch.re)
+        self.sync.counter += If(latch_sync.o, latch_value.eq(counter))
+        self.specials += MultiReg(latch_value, self.value.status)
+
 # ADC08DJ5200RF Core -------------------------------------------------------------------------------
 
 class ADC08DJ5200RFCore(LiteXModule):
@@ -36,21 +91,29 @@ class ADC08DJ5200RFCore(LiteXModule):
         stpl_random = True,
         framing     = False,
     ):
-        self.sample = sample = Signal(255)
+        assert sorted(adc08dj_phy_rx_order) == list(range(adc08dj_jesd_lanes))
+        assert len(adc08dj_phy_rx_polarity) == adc08dj_jesd_lanes
 
         # JESD Configuration -----------------------------------------------------------------------
-        if adc08dj_jesd_lanes == 4:
-            ps_rx = JESD204BPhysicalSettings(l=4, m=4, n=8, np=8)
-        if adc08dj_jesd_lanes == 8:
-            ps_rx = JESD204BPhysicalSettings(l=8, m=8, n=8, np=8)
-        ts_rx = JESD204BTransportSettings(f=2, s=1, k=32, cs=0)
+        mode  = adc08dj_jesd_modes[adc08dj_jesd_lanes]
+        ps_rx = JESD204BPhysicalSettings(l=mode["l"], m=mode["m"], n=mode["n"], np=mode["np"])
+        ts_rx = JESD204BTransportSettings(f=mode["f"], s=mode["s"], k=mode["k"], cs=mode["cs"])
         settings_rx = JESD204BSettings(ps_rx, ts_rx, did=0x5a, bid=0x5, framing=framing, scrambling=scrambling)
 
+        # Converter data width: each lane provides 4 octets per JESD clock cycle, shared between M converters.
+        converter_data_width = (ps_rx.l*4*8)//ps_rx.m
+        assert converter_data_width % ps_rx.np == 0
+
+        self.sample = sample = Signal(ps_rx.m*converter_data_width)
+        self.source = stream.Endpoint([("data", len(sample))])
+
         # JESD Clocking (Device) -------------------------------------------------------------------
         userclk_freq = adc08dj_jesd_linerate/40 # 6.25GHz / 40 = 156.25 MHz
         self.cd_jesd   = ClockDomain()
         self.cd_refclk = ClockDomain()
 
+        # refclk (IBUFDS_GTE4.O) only feeds the QPLLs; refclk_div2 (IBUFDS_GTE4.ODIV2) only feeds
+        # the fabric MMCM through BUFG_GT so no fabric clock buffer sits on the transceivers' refclk.
         refclk_pads      = platform.request("adc08dj5200rf_refclk")
         refclk           = Signal()
         refclk_div2      = Signal()
@@ -78,25 +141,28 @@ class ADC08DJ5200RFCore(LiteXModule):
             i_I   = refclk_div2,
             o_O   = refclk_div2_bufg,
         )
-        self.submodules.pll = pll = USPMMCM(speedgrade=-2)
-        pll.register_clkin(refclk_div2_bufg, adc08dj_refclk_freq/2)
-        pll.create_clkout(self.cd_jesd, userclk_freq, with_reset=False)
-        pll.create_clkout(self.cd_refclk, adc08dj_refclk_freq)
+        self.jesd_mmcm = jesd_mmcm = USPMMCM(speedgrade=-2)
+        jesd_mmcm.register_clkin(refclk_div2_bufg, adc08dj_refclk_freq/2)
+        jesd_mmcm.create_clkout(self.cd_jesd, userclk_freq, with_reset=False)
+        jesd_mmcm.create_clkout(self.cd_refclk, adc08dj_refclk_freq)
         platform.add_period_constraint(refclk_div2, 1e9/(adc08dj_refclk_freq/2))
 
         # JESD Clocking (SysRef) -------------------------------------------------------------------
         self.sysref = sysref = Signal()
         sysref_pads = platform.request("adc08dj5200rf_sysref")
         self.specials += DifferentialInput(sysref_pads.p, sysref_pads.n, sysref)
+        platform.add_platform_command("set_false_path -from [get_ports {sysref_p}]", sysref_p=sysref_pads.p)
 
         # JESD PHYs --------------------------------------------------------------------------------
         self.jesd_phys = jesd_phys = []
+        # GTH4QuadPLL (1 shared per quad, channels CPLLs are left unused).
+        self.jesd_plls = jesd_plls = []
+        for n in range((adc08dj_jesd_lanes + 3)//4):
+            jesd_pll = GTH4QuadPLL(refclk, adc08dj_refclk_freq, adc08dj_jesd_linerate)
+            self.submodules += jesd_pll
+            jesd_plls.append(jesd_pll)
         for i in range(adc08dj_jesd_lanes):
-            # GTH4QuadPLL (1 shared per quad).
-            if (i%4 == 0):
-                jesd_pll = GTH4QuadPLL(refclk, adc08dj_refclk_freq, adc08dj_jesd_linerate)
-                self.submodules += jesd_pll
-                print(jesd_pll)
+            jesd_pll = jesd_plls[i//4]
             # GTH4.
             jesd_tx_pads = platform.request("adc08dj5200rf_jesd_tx", i)
             jesd_rx_pads = platform.request("adc08dj5200rf_jesd_rx", i)
@@ -114,24 +180,26 @@ class ADC08DJ5200RFCore(LiteXModule):
             jesd_phy.add_controls(auto_enable=False)
             jesd_phy.n = i
             setattr(self.submodules, "jesd_phy" + str(i), jesd_phy)
-            platform.add_period_constraint(jesd_phy.cd_tx.clk, 1e9/jesd_phy.tx_clk_freq)
-            platform.add_period_constraint(jesd_phy.cd_rx.clk, 1e9/jesd_phy.rx_clk_freq)
-            platform.add_false_path_constraints(
-                LiteXContext.top.crg.cd_sys.clk,
-                self.cd_jesd.clk,
-                jesd_phy.cd_tx.clk,
-                jesd_phy.cd_rx.clk)
             jesd_phys.append(jesd_phy)
 
-        jesd_phys_tx_init_done = reduce(and_, [phy.tx_init.done for phy in jesd_phys])
-        jesd_phys_rx_init_done = reduce(and_, [phy.rx_init.done for phy in jesd_phys])
+        # TX/RX Clks are generated by PHY0 and shared with the other PHYs: constrain them only once.
+        platform.add_period_constraint(jesd_phys[0].cd_tx.clk, 1e9/jesd_phys[0].tx_clk_freq)
+        platform.add_period_constraint(jesd_phys[0].cd_rx.clk, 1e9/jesd_phys[0].rx_clk_freq)
+        platform.add_false_path_constraints(
+            LiteXContext.top.crg.cd_sys.clk,
+            self.cd_jesd.clk,
+            jesd_phys[0].cd_tx.clk,
+            jesd_phys[0].cd_rx.clk)
+
+        jesd_phys_tx_init_done = tree_and([phy.tx_init.done for phy in jesd_phys])
+        jesd_phys_rx_init_done = tree_and([phy.rx_init.done for phy in jesd_phys])
         self.specials += AsyncResetSynchronizer(self.cd_jesd, ~(jesd_phys_tx_init_done & jesd_phys_rx_init_done))
 
         jesd_phys_rx = [jesd_phys[adc08dj_phy_rx_order[n]] for n in range(adc08dj_jesd_lanes)]
 
         # JESD RX ----------------------------------------------------------------------------------
         self.submodules.jesd_rx_core    = LiteJESD204BCoreRX(jesd_phys_rx, settings_rx,
-            converter_data_width = 8*4, # 8 bit times 4 samples 
+            converter_data_width = converter_data_width,
             scrambling           = scrambling,
             stpl_random          = stpl_random,
         )
@@ -140,53 +208,71 @@ class ADC08DJ5200RFCore(LiteXModule):
         self.jesd_rx_core.register_jref(sysref)
 
         # JESD Link Status -------------------------------------------------------------------------
-        self.jesd_link_status = Signal()
+        self.jesd_link_status  = Signal()
+        self.jesd_overflow     = Signal()
+        self._jesd_link_status = CSRStatus(fields=[
+            CSRField("link",         size=1, offset=0, description="JESD Link Status (1: PHYs/Core enabled & Synced)."),
+            CSRField("jsync",        size=1, offset=1, description="JESD RX Core JSync."),
+            CSRField("enable",       size=1, offset=2, description="JESD RX Core Enable."),
+            CSRField("rx_init_done", size=1, offset=3, description="JESD RX PHYs Init Done."),
+            CSRField("tx_init_done", size=1, offset=4, description="JESD TX PHYs Init Done."),
+            CSRField("overflow",     size=1, offset=5, description="JESD RX Stream Overflow (Sticky, 1: Samples have been dropped)."),
+        ])
+        self._jesd_overflow_clear = CSR()
         self.comb += self.jesd_link_status.eq(
-            (self.jesd_rx_core.enable & self.jesd_rx_core.jsync) &
-            (self.jesd_rx_core.enable & self.jesd_rx_core.jsync))
+            self.jesd_rx_core.enable &
+            self.jesd_rx_core.jsync  &
+            jesd_phys_rx_init_done)
+        # All link bring-up status bits in a single register: one MMIO read (over PCIe BAR0 or
+        # Etherbone) instead of one per status.
+        self.specials += MultiReg(Cat(
+            self.jesd_link_status,
+            self.jesd_rx_core.jsync,
+            self.jesd_rx_core.enable,
+            jesd_phys_rx_init_done,
+            jesd_phys_tx_init_done,
+            self.jesd_overflow,
+        ), self._jesd_link_status.status)
         
         # JESD lane mapping -------------------------------------------------------------------------
-        sorted_samples = []
-        for sample_i in [3,2,1,0]:
-            print(sample_i)
-            # Converters' samples for a frame
-            sorted_samples = []
-            for i in [0, 4, 1, 5, 2, 6, 3, 7]:
-                converter_data = getattr(self.jesd_rx_core.source, "converter"+str(i))
-                current_sample = converter_data[sample_i*8:((sample_i+1)*8)]
-                sorted_samples.append(current_sample)
-
-            for i in [7,6,5,4,3,2,1,0]:
-                start = (sample_i*64)+(i*8)
-                end = ((sample_i+1)*64)-((8-1-i)*8)
-                print("start: " + str(start))
-                print("end: " + str(end))
-                self.comb += sample[start:end].eq(sorted_samples.pop())
-
-        # Clk Measurements -------------------------------------------------------------------------
-
-        class ClkMeasurement(LiteXModule):
-            def __init__(self, clk, increment=1):
-                self.latch = CSR()
-                self.value = CSRStatus(64)
+        # Samples are ordered by sample index, then by converter interleaved between the two halves
+        # of the converters (ex for M=8: 0, 4, 1, 5, 2, 6, 3, 7).
+        samples_per_converter = converter_data_width//ps_rx.np
+        converter_order = [c for pair in zip(range(ps_rx.m//2), range(ps_rx.m//2, ps_rx.m)) for c in pair]
+        assert len(sample) == samples_per_converter*len(converter_order)*ps_rx.np
+        for sample_i in range(samples_per_converter):
+            for n, converter_i in enumerate(converter_order):
+                converter_data = getattr(self.jesd_rx_core.source, "converter"+str(converter_i))
+                start = (sample_i*ps_rx.m + n)*ps_rx.np
+                self.comb += sample[start:start + ps_rx.np].eq(
+                    converter_data[sample_i*ps_rx.np:(sample_i + 1)*ps_rx.np])
 
-                # # #
-
-                # Create Clock Domain.
-                self.cd_counter = ClockDomain()
-                self.comb += self.cd_counter.clk.eq(clk)
-                self.specials += AsyncResetSynchronizer(self.cd_counter, ResetSignal())
-
-                # Free-running Clock Counter.
-                counter = Signal(64)
-                self.sync.counter += counter.eq(counter + increment)
+        # JESD RX Stream ---------------------------------------------------------------------------
+        # Frame samples are aggregated in a single wide word per cycle and moved to sys domain, first
+        # marks the start of a multiframe (LMFC zero) so consumers can re-align after an overflow.
+        self.cdc = cdc = stream.ClockDomainCrossing([("data", len(sample))],
+            cd_from = "jesd",
+            cd_to   = "sys",
+            depth   = 16,
+        )
+        self.comb += [
+            cdc.sink.valid.eq(self.jesd_rx_core.ready),
+            cdc.sink.first.eq(self.jesd_rx_core.lmfc.zero),
+            cdc.sink.data.eq(sample),
+            cdc.source.connect(self.source),
+        ]
 
-                # Latch Clock Counter.
-                latch_value = Signal(64)
-                latch_sync  = PulseSynchronizer("sys", "counter")
-                self.submodules += latch_sync
-                self.comb += latch_sync.i.eq(self.latch.re)
-                self.sync.counter += If(latch_sync.o, latch_value.eq(counter))
-                self.specials += MultiReg(latch_value, self.value.status)
+        # Sticky Overflow flag (Samples dropped when the CDC is not ready), cleared from sys.
+        overflow_clear_sync = PulseSynchronizer("sys", "jesd")
+        self.submodules += overflow_clear_sync
+        self.comb += overflow_clear_sync.i.eq(self._jesd_overflow_clear.re)
+        self.sync.jesd += [
+            If(overflow_clear_sync.o,
+                self.jesd_overflow.eq(0)
+            ).Elif(cdc.sink.valid & ~cdc.sink.ready,
+                self.jesd_overflow.eq(1)
+            )
+        ]
 
+        # Clk Measurements -------------------------------------------------------------------------
         self.refclk_measurement = ClkMeasurement(clk=self.cd_refclk.clk)